@@ -2,63 +2,163 @@ import streamlit as st
 from google.oauth2 import service_account
 import gspread
 import pandas as pd
-import random
-from datetime import datetime
+import numpy as np
 import json
 import os
-from collections import defaultdict
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+# Número máximo de intentos guardados por palabra
+MAX_ATTEMPTS = 50
+
+# Generador aleatorio compartido para la selección de palabras
+_rng = np.random.default_rng()
+
+# Historial junto al script, independiente del directorio de trabajo
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.db")
+
+# La conexión SQLite se comparte entre los hilos de las sesiones de Streamlit
+_db_lock = threading.Lock()
+
+@st.cache_resource
+def _get_gspread_client():
+    # Crear credenciales desde los secretos de Streamlit
+    credentials = service_account.Credentials.from_service_account_info(
+        st.secrets["gcp_service_account"],
+        scopes=['https://www.googleapis.com/auth/spreadsheets']
+    )
+    
+    # Autorizar el cliente de gspread (se reutiliza entre ejecuciones)
+    return gspread.authorize(credentials)
+
+@st.cache_resource
+def _get_history_db(path):
+    # Una única conexión compartida entre ejecuciones del script
+    conn = sqlite3.connect(path, check_same_thread=False)
+    with conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS hist ("
+            "word TEXT PRIMARY KEY, correct INT, total INT, tematica TEXT)"
+        )
+    return conn
+
+def _normalize_vocabulary(df):
+    # Verificar las columnas
+    expected_columns = ['TEMATICA', 'INGLES', 'ESPAÑOL', 'COMENTARIOS']
+    missing_columns = [col for col in expected_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"Faltan las siguientes columnas: {missing_columns}")
+    
+    # Renombrar las columnas para trabajar con ellas más fácilmente
+    df.columns = df.columns.str.lower()
+    
+    # Normalizar tipos una sola vez por carga
+    df['tematica'] = df['tematica'].astype('category')
+    for col in ['ingles', 'español', 'comentarios']:
+        df[col] = df[col].astype('string')
+    return df
+
+def _load_csv(url: str) -> pd.DataFrame:
+    # Hoja pública exportada como CSV: sin credenciales ni cuota de la API de Sheets
+    df = pd.read_csv(url, dtype=str, keep_default_na=False)
+    return _normalize_vocabulary(df)
+
+def _load_sheet(sheet_name: str) -> pd.DataFrame:
+    gc = _get_gspread_client()
+    
+    # Abrir el archivo de Google Sheets
+    sheet = gc.open(sheet_name)
+    worksheet = sheet.get_worksheet(0)  # Obtener la primera hoja
+    
+    # Leer todas las celdas de una vez (mucho más rápido que get_all_records)
+    rows = worksheet.get_all_values()
+    header = rows[0] if rows else []
+    df = pd.DataFrame(rows[1:], columns=header)
+    return _normalize_vocabulary(df)
 
 class VocabularyTrainer:
-    def __init__(self, sheet_name):
-        self.sheet_name = sheet_name
-        self.history_file = None
+    def __init__(self, loader):
+        # loader: función sin argumentos que devuelve el DataFrame de vocabulario
+        self.loader = loader
+        self.history_file = HISTORY_FILE
         self.df = None
-        self.history = {}
-        self.setup_google_sheets()
-        self.setup_history()
+        # Identificador simple para que cada sesión sepa con qué entrenador se calcularon sus pesos
+        self.token = uuid.uuid4().hex
+        self.setup_data()
+        self.setup_arrays()
+        self._db = _get_history_db(self.history_file)
 
-    def setup_google_sheets(self):
+    def setup_data(self):
         try:
-            # Crear credenciales desde los secretos de Streamlit
-            credentials = service_account.Credentials.from_service_account_info(
-                st.secrets["gcp_service_account"],
-                scopes=['https://www.googleapis.com/auth/spreadsheets']
-            )
-            
-            # Autorizar el cliente de gspread
-            gc = gspread.authorize(credentials)
-            
-            # Abrir el archivo de Google Sheets
-            sheet = gc.open(self.sheet_name)
-            worksheet = sheet.get_worksheet(0)  # Obtener la primera hoja
-            
-            # Convertir a DataFrame
-            data = worksheet.get_all_records()
-            self.df = pd.DataFrame(data)
-            
-            # Verificar las columnas
-            expected_columns = ['TEMATICA', 'INGLES', 'ESPAÑOL', 'COMENTARIOS']
-            missing_columns = [col for col in expected_columns if col not in self.df.columns]
-            if missing_columns:
-                raise ValueError(f"Faltan las siguientes columnas: {missing_columns}")
-            
-            # Renombrar las columnas para trabajar con ellas más fácilmente
-            self.df.columns = self.df.columns.str.lower()
-        
+            self.df = self.loader()
+            self._topics_sorted = sorted(self.df['tematica'].unique().tolist())
         except Exception as e:
-            st.error(f"Error al abrir el archivo de Google Sheets: {str(e)}")
+            st.error(f"Error al cargar el vocabulario: {str(e)}")
             raise
 
-    def setup_history(self):
+    # El entrenador se comparte entre sesiones (st.cache_resource), así que el
+    # estado de cada sesión vive en st.session_state y se crea bajo demanda.
+    # La aplicación es de un solo usuario: history.db no distingue usuarios y
+    # todas las sesiones leen y actualizan las mismas estadísticas.
+    @property
+    def history(self):
+        # Cargar el historial persistido solo una vez por sesión
         if 'history' not in st.session_state:
-            st.session_state.history = {}
-        self.history = st.session_state.history
+            with _db_lock:
+                rows = self._db.execute("SELECT word, correct, total, tematica FROM hist").fetchall()
+            st.session_state.history = {
+                word: {'correct': correct, 'total': total, 'tematica': tematica, 'attempts': deque(maxlen=MAX_ATTEMPTS)}
+                for word, correct, total, tematica in rows
+            }
+        return st.session_state.history
+
+    def _setup_session_weights(self):
+        # Los pesos están alineados con self.df: rehacerlos si el entrenador se ha recargado
+        if st.session_state.get('weights_token') != self.token:
+            st.session_state.word_weights = np.array(
+                [self.get_word_weight(word) for word in self._esp], dtype=np.float64
+            )
+            st.session_state.weights_token = self.token
+
+    @property
+    def _weights(self):
+        self._setup_session_weights()
+        return st.session_state.word_weights
+
+    def setup_arrays(self):
+        # Arrays de solo lectura alineados con self.df para seleccionar palabras sin recorrer filas en Python
+        self._esp = self.df['español'].to_numpy()
+        self._ing = self.df['ingles'].to_numpy()
+        self._ing_lc = self.df['ingles'].str.lower().to_numpy()
+        self._tema = self.df['tematica'].to_numpy()
+        self._com = self.df['comentarios'].to_numpy()
+        codes = self.df['tematica'].cat.codes.to_numpy()
+        self._all_idx = np.arange(len(self.df))
+        # Filas de cada palabra, para actualizar su peso sin recorrer todo el vocabulario
+        self._word_rows = self.df.groupby('español', sort=False).indices
+        self._topic_idx = {
+            tema: np.flatnonzero(codes == code) for code, tema in enumerate(self.df['tematica'].cat.categories)
+        }
 
-    def save_history(self):
-        st.session_state.history = self.history
+    def update_word_weight(self, word):
+        rows = self._word_rows.get(word)
+        if rows is not None:
+            self._weights[rows] = self.get_word_weight(word)
+
+    def save_history(self, word, is_correct, tematica):
+        # Guardar solo el incremento para no pisar lo escrito por otras sesiones
+        with _db_lock, self._db:
+            self._db.execute(
+                "INSERT INTO hist (word, correct, total, tematica) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(word) DO UPDATE SET correct = correct + excluded.correct, total = total + 1",
+                (word, int(is_correct), tematica)
+            )
 
     def get_available_topics(self):
-        return sorted(self.df['tematica'].unique())
+        return self._topics_sorted
 
     def get_word_weight(self, word):
         if word not in self.history:
@@ -72,20 +172,42 @@ class VocabularyTrainer:
 
     def select_word(self, selected_topic=None):
         if selected_topic and selected_topic != "Todas las temáticas":
-            topic_df = self.df[self.df['tematica'] == selected_topic]
-            if topic_df.empty:
+            pool = self._topic_idx.get(selected_topic)
+            if pool is None:
                 return None
-            weights = [self.get_word_weight(word) for word in topic_df['español']]
-            word_index = random.choices(range(len(topic_df)), weights=weights)[0]
-            return topic_df.iloc[word_index]
         else:
-            weights = [self.get_word_weight(word) for word in self.df['español']]
-            word_index = random.choices(range(len(self.df)), weights=weights)[0]
-            return self.df.iloc[word_index]
+            pool = self._all_idx
+        if len(pool) == 0:
+            return None
+        weights = self._weights[pool]
+        total = weights.sum()
+        # Si todas las palabras están dominadas, elegir de manera uniforme
+        probs = weights / total if total > 0 else None
+        word_index = int(_rng.choice(pool, p=probs))
+        # Guardar solo cadenas simples en st.session_state
+        return {
+            'español': str(self._esp[word_index]),
+            'ingles': str(self._ing[word_index]),
+            'ingles_lc': str(self._ing_lc[word_index]),
+            'tematica': str(self._tema[word_index]),
+            'comentarios': str(self._com[word_index]),
+        }
 
     def reset_statistics(self):
-        self.history = {}
-        self.save_history()
+        # Borra el historial compartido completo (aplicación de un solo usuario)
+        self.history.clear()
+        self._weights.fill(1.0)
+        with _db_lock, self._db:
+            self._db.execute("DELETE FROM hist")
+
+# Único caché de los datos: los cargadores no se cachean aparte para que el
+# vocabulario nunca tenga más de 10 minutos de antigüedad
+@st.cache_resource(ttl=600, show_spinner=False)
+def get_trainer(sheet_name: str, public_url=None) -> VocabularyTrainer:
+    # Usar la exportación CSV si la hoja es pública; gspread solo para hojas privadas
+    if public_url:
+        return VocabularyTrainer(lambda: _load_csv(public_url))
+    return VocabularyTrainer(lambda: _load_sheet(sheet_name))
 
 def main():
     st.set_page_config(page_title="Entrenador de Vocabulario", page_icon="📚")
@@ -93,7 +215,7 @@ def main():
     st.title("📚 Entrenador de Vocabulario")
     
     try:
-        trainer = VocabularyTrainer("VOCABULARY EXCEL")
+        trainer = get_trainer("VOCABULARY EXCEL", st.secrets.get("public_gsheets_url"))
     except Exception as e:
         st.error("Error al inicializar el entrenador de vocabulario. Verifica la conexión con Google Sheets.")
         st.stop()
@@ -117,50 +239,43 @@ def main():
         if 'current_word' not in st.session_state:
             st.session_state.current_word = trainer.select_word(selected_topic)
         
-        if st.session_state.current_word is not None:
-            st.write(f"**Palabra en español:** {st.session_state.current_word['español']}")
+        current_word = st.session_state.current_word
+        if current_word is not None:
+            st.write(f"**Palabra en español:** {current_word['español']}")
             
-            user_answer = st.text_input("Escribe la traducción en inglés:", key="answer_input")
+            def next_word():
+                # Se ejecuta antes de la siguiente ejecución del script, sin necesidad de rerun
+                st.session_state.current_word = trainer.select_word(selected_topic)
             
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button("Comprobar"):
-                    if user_answer.lower() == st.session_state.current_word['ingles'].lower():
-                        st.success("¡Correcto!")
-                        word = st.session_state.current_word['español']
-                        if word not in trainer.history:
-                            trainer.history[word] = {
-                                'correct': 0, 
-                                'total': 0, 
-                                'tematica': st.session_state.current_word['tematica'],
-                                'attempts': []
-                            }
-                        trainer.history[word]['correct'] += 1
-                        trainer.history[word]['total'] += 1
-                    else:
-                        st.error(f"Incorrecto. La respuesta correcta era: {st.session_state.current_word['ingles']}")
-                        word = st.session_state.current_word['español']
-                        if word not in trainer.history:
-                            trainer.history[word] = {
-                                'correct': 0, 
-                                'total': 0, 
-                                'tematica': st.session_state.current_word['tematica'],
-                                'attempts': []
-                            }
-                        trainer.history[word]['total'] += 1
-                    
-                    trainer.history[word]['attempts'].append({
-                        'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        'correct': user_answer.lower() == st.session_state.current_word['ingles'].lower()
-                    })
-                    
-                    st.write(f"Comentario: {st.session_state.current_word['comentarios']}")
-                    trainer.save_history()
+            # Agrupar la respuesta y los botones para ejecutar el script solo al enviar
+            with st.form("practice", clear_on_submit=False):
+                user_answer = st.text_input("Escribe la traducción en inglés:", key="answer_input")
+                
+                col1, col2 = st.columns(2)
+                check = col1.form_submit_button("Comprobar")
+                col2.form_submit_button("Siguiente palabra", on_click=next_word)
             
-            with col2:
-                if st.button("Siguiente palabra"):
-                    st.session_state.current_word = trainer.select_word(selected_topic)
-                    st.experimental_rerun()
+            if check:
+                is_correct = user_answer.lower() == current_word['ingles_lc']
+                word = current_word['español']
+                entry = trainer.history.setdefault(word, {
+                    'correct': 0, 
+                    'total': 0, 
+                    'tematica': current_word['tematica'],
+                    'attempts': deque(maxlen=MAX_ATTEMPTS)
+                })
+                entry['total'] += 1
+                entry['correct'] += is_correct
+                entry['attempts'].append({'t': int(time.time()), 'ok': is_correct})
+                
+                if is_correct:
+                    st.success("¡Correcto!")
+                else:
+                    st.error(f"Incorrecto. La respuesta correcta era: {current_word['ingles']}")
+                
+                st.write(f"Comentario: {current_word['comentarios']}")
+                trainer.update_word_weight(word)
+                trainer.save_history(word, is_correct, current_word['tematica'])
     
     elif menu_option == "Estadísticas":
         st.header("Estadísticas")
@@ -168,24 +283,23 @@ def main():
         if not trainer.history:
             st.info("Aún no hay estadísticas disponibles.")
         else:
-            tematica_stats = defaultdict(lambda: {'correct': 0, 'total': 0})
+            hist_df = pd.DataFrame.from_dict(trainer.history, orient='index')[['correct', 'total', 'tematica']]
+            hist_df['tematica'] = hist_df['tematica'].fillna('Sin temática')
+            tematica_stats = hist_df.groupby('tematica', sort=False)[['correct', 'total']].sum()
+            tematica_stats['success_rate'] = (
+                tematica_stats['correct'] / tematica_stats['total'].where(tematica_stats['total'] > 0, 1) * 100
+            )
             
-            for word, data in trainer.history.items():
-                tematica = data.get('tematica', 'Sin temática')
-                tematica_stats[tematica]['correct'] += data['correct']
-                tematica_stats[tematica]['total'] += data['total']
+            # Mostrar solo los indicadores de la temática elegida
+            chosen = st.selectbox("Temática:", tematica_stats.index.tolist())
+            stats = tematica_stats.loc[chosen]
             
-            for tematica, stats in tematica_stats.items():
-                correct = stats['correct']
-                total = stats['total']
-                success_rate = (correct / total * 100) if total > 0 else 0
-                
-                st.write(f"### {tematica}")
-                col1, col2, col3 = st.columns(3)
-                col1.metric("Correctas", correct)
-                col2.metric("Total", total)
-                col3.metric("Tasa de éxito", f"{success_rate:.1f}%")
-                st.progress(success_rate / 100)
+            st.write(f"### {chosen}")
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Correctas", int(stats['correct']))
+            col2.metric("Total", int(stats['total']))
+            col3.metric("Tasa de éxito", f"{stats['success_rate']:.1f}%")
+            st.progress(stats['success_rate'] / 100)
     
     elif menu_option == "Resetear Estadísticas":
         st.header("Resetear Estadísticas")